@@ -1,10 +1,8 @@
 # config.py
 from storage import Storage
 
-_storage = Storage()
-
 def get_config(key: str, default=None):
-    return _storage.get_config(key, default)
+    return Storage().get_config(key, default)
 
 def set_config(key: str, value: str):
-    _storage.set_config(key, value)
+    Storage().set_config(key, value)
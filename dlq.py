@@ -1,11 +1,9 @@
 # dlq.py
-from storage import Storage
+from storage import Storage, job_to_dict
 import json
 
-storage = Storage()
-
 def list_dlq(limit: int = 100):
-    return [dict(r) for r in storage.list_dead(limit)]
+    return [job_to_dict(r) for r in Storage().list_dead(limit)]
 
 def retry(job_id: int):
-    storage.retry_dead_job(job_id)
+    Storage().retry_dead_job(job_id)
@@ -3,11 +3,26 @@ import click
 import json
 import os
 import uuid
-from storage import Storage
-from worker import start_workers, PIDFILE, STOP_FLAG
+from storage import Storage, job_tuples_to_dicts
+from worker import start_workers, remove_if_exists, PIDFILE
 import sys
 
-storage = Storage()
+# orjson is optional; it is several times faster for large listings
+try:
+    import orjson
+
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> str:
+        # same compact, raw-UTF-8 output as orjson
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+    json_loads = json.loads
+
+BULK_CHUNK_SIZE = 500
 
 @click.group()
 def cli():
@@ -16,8 +31,9 @@ def cli():
 @cli.command(help="Enqueue a job. Provide JSON with at least 'command'. Optional: id (external), max_retries.")
 @click.argument("job_json")
 def enqueue(job_json):
+    storage = Storage()
     try:
-        job = json.loads(job_json)
+        job = json_loads(job_json)
     except Exception as e:
         raise click.ClickException(f"Invalid JSON: {e}")
     # generate external id if none provided
@@ -29,6 +45,38 @@ def enqueue(job_json):
         raise click.ClickException(f"Failed to add job: {e}")
     click.echo(f"Enqueued job internal_id={internal_id} external_id={job.get('external_id') or job.get('id')}")
 
+@cli.command("bulk-enqueue", help="Enqueue jobs from stdin, one JSON object per line (same format as enqueue).")
+def bulk_enqueue():
+    storage = Storage()
+    total = 0
+    chunk = []
+
+    def flush():
+        nonlocal total
+        try:
+            storage.add_jobs(chunk)
+        except Exception as e:
+            raise click.ClickException(f"Failed to add jobs (after {total} enqueued): {e}")
+        total += len(chunk)
+        chunk.clear()
+
+    for lineno, line in enumerate(sys.stdin, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json_loads(line)
+        except Exception as e:
+            raise click.ClickException(f"Invalid JSON on line {lineno}: {e}")
+        if "id" not in job and "external_id" not in job:
+            job["external_id"] = str(uuid.uuid4())
+        chunk.append(job)
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            flush()
+    if chunk:
+        flush()
+    click.echo(f"Enqueued {total} jobs")
+
 @cli.group(help="Worker management")
 def worker():
     pass
@@ -41,25 +89,28 @@ def start(count, daemon):
 
 @worker.command("stop", help="Stop workers gracefully")
 def stop():
-    # create stop flag and try to signal PIDs in pidfile
-    open(STOP_FLAG, "w").close()
-    click.echo(f"Created stop flag: {STOP_FLAG}")
-    if os.path.exists(PIDFILE):
-        with open(PIDFILE, "r") as f:
-            for line in f:
-                try:
-                    pid = int(line.strip())
-                    click.echo(f"Sending SIGTERM to {pid}")
-                    os.kill(pid, 15)
-                except Exception as e:
-                    click.echo(f"Could not signal {line.strip()}: {e}")
-        try:
-            os.remove(PIDFILE)
-        except Exception:
-            pass
+    # SIGTERM sets each worker's stop event: it finishes its current job, then exits
+    try:
+        f = open(PIDFILE, "r")
+    except FileNotFoundError:
+        click.echo(f"No pidfile ({PIDFILE}); no workers to stop")
+        return
+    with f:
+        for line in f:
+            try:
+                pid = int(line.strip())
+                click.echo(f"Sending SIGTERM to {pid}")
+                os.kill(pid, 15)
+            except Exception as e:
+                click.echo(f"Could not signal {line.strip()}: {e}")
+    try:
+        os.remove(PIDFILE)
+    except Exception:
+        pass
 
 @cli.command("status", help="Show job counts and active workers")
 def status():
+    storage = Storage()
     counts = storage.state_counts()
     workers = storage.count_workers()
     click.echo("Jobs by state:")
@@ -71,10 +122,10 @@ def status():
 @click.option("--state", "-s", default=None, help="Filter by state")
 @click.option("--limit", "-n", default=100)
 def list_jobs(state, limit):
-    rows = storage.list_jobs(state, limit)
-    for r in rows:
-        d = dict(r)
-        click.echo(json.dumps(d))
+    storage = Storage()
+    keys, rows = storage.iter_jobs(state, limit)
+    for d in job_tuples_to_dicts(keys, rows):
+        click.echo(json_dumps(d))
 
 @cli.group("dlq", help="DLQ operations")
 def dlq():
@@ -82,13 +133,15 @@ def dlq():
 
 @dlq.command("list", help="List dead jobs")
 def dlq_list():
-    rows = storage.list_dead()
-    for r in rows:
-        click.echo(json.dumps(dict(r)))
+    storage = Storage()
+    keys, rows = storage.iter_jobs("dead")
+    for d in job_tuples_to_dicts(keys, rows):
+        click.echo(json_dumps(d))
 
 @dlq.command("retry", help="Retry a dead job (by internal id)")
 @click.argument("job_id", type=int)
 def dlq_retry(job_id):
+    storage = Storage()
     try:
         storage.retry_dead_job(job_id)
         click.echo(f"Retried job {job_id}")
@@ -105,30 +158,36 @@ def cfg():
 @click.argument("key")
 @click.argument("value")
 def cfg_set(key, value):
+    storage = Storage()
     storage.set_config(key, value)
     click.echo(f"Set {key} = {value}")
 
 @cfg.command("get", help="Get config value")
 @click.argument("key")
 def cfg_get(key):
+    storage = Storage()
     val = storage.get_config(key)
     click.echo(val if val is not None else "")
 
+@cli.command("housekeep", help="Archive completed/dead jobs older than --max-age seconds and checkpoint the WAL")
+@click.option("--max-age", default=86400, help="Minimum age in seconds since last update")
+def housekeep(max_age):
+    storage = Storage()
+    archived = storage.housekeep(max_age)
+    click.echo(f"Archived {archived} jobs")
+
 @cli.command("dropdb", help="Delete DB and reset (dev only)", )
 @click.confirmation_option(prompt="Are you sure?")
 def dropdb():
+    storage = Storage()
     path = storage.db_path
     try:
         storage.conn.close()
     except Exception:
         pass
-    if os.path.exists(path):
-        os.remove(path)
-    if os.path.exists(PIDFILE):
-        os.remove(PIDFILE)
-    if os.path.exists(STOP_FLAG):
-        os.remove(STOP_FLAG)
-    click.echo("Removed DB and worker flags")
+    remove_if_exists(path)
+    remove_if_exists(PIDFILE)
+    click.echo("Removed DB and worker pidfile")
 
 if __name__ == "__main__":
     cli()
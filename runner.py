@@ -2,41 +2,45 @@
 # A unified runner that starts workers and submits jobs automatically.
 # This lets you run your entire queue system from ONE file.
 
-import os
 import time
 import json
 import signal
 from multiprocessing import Process
 
 from storage import Storage
-from worker import start_workers, STOP_FLAG, PIDFILE
+from worker import start_workers, remove_if_exists, PIDFILE
 
-storage = Storage()
+HOUSEKEEP_INTERVAL = 300  # seconds
 
-RUNNER_STOP = False
+STOP_SIGNALS = {signal.SIGINT, signal.SIGTERM}
 
-def handle_sigint(sig, frame):
-    global RUNNER_STOP
-    print("\n[runner] Ctrl+C detected, stopping...")
-    RUNNER_STOP = True
-    # create stop flag for workers
-    open(STOP_FLAG, "w").close()
 
-signal.signal(signal.SIGINT, handle_sigint)
+def run_child(target):
+    """Process entry point for helper loops; Ctrl+C is handled by the runner."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the runner blocks the stop signals; terminate() must still work here
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+    target()
 
 
 def wait_for_workers():
     """Wait until workers_meta table has at least one worker registered."""
+    storage = Storage()
     print("[runner] Waiting for workers to register...")
+    version = storage.data_version()
     while storage.count_workers() == 0:
-        time.sleep(0.2)
+        # only re-count once some other process has written to the DB
+        while storage.data_version() == version:
+            time.sleep(0.2)
+        version = storage.data_version()
     print(f"[runner] {storage.count_workers()} workers active.")
 
 
 def auto_enqueue_loop():
     """Continuously add example jobs into queue."""
+    storage = Storage()
     counter = 1
-    while not RUNNER_STOP:
+    while True:
         cmd = f"echo 'job {counter}: processed'"
         job = {
             "command": cmd,
@@ -50,50 +54,70 @@ def auto_enqueue_loop():
 
 def status_loop():
     """Print queue status periodically."""
-    while not RUNNER_STOP:
-        counts = storage.state_counts()
-        workers = storage.count_workers()
-        print("\n[runner-status]")
-        print("----------------------------")
-        print(f"workers: {workers}")
-        for s, c in counts.items():
-            print(f"{s}: {c}")
-        print("----------------------------\n")
+    storage = Storage()
+    version = None
+    while True:
+        # skip the queries (and the repeated printout) while nothing changed
+        current = storage.data_version()
+        if current != version:
+            version = current
+            counts = storage.state_counts()
+            workers = storage.count_workers()
+            print("\n[runner-status]")
+            print("----------------------------")
+            print(f"workers: {workers}")
+            for s, c in counts.items():
+                print(f"{s}: {c}")
+            print("----------------------------\n")
 
         time.sleep(5)
 
 
-def main():
-    print("=== QueueCTL Runner ===")
-    print("Starting workers...")
+def housekeep_loop():
+    """Archive old finished jobs and checkpoint the WAL periodically."""
+    storage = Storage()
+    while True:
+        time.sleep(HOUSEKEEP_INTERVAL)
+        archived = storage.housekeep()
+        print(f"[runner] Housekeeping archived {archived} jobs")
 
-    # Start workers
-    start_workers(count=2, daemon=True)
 
-    wait_for_workers()
+def main():
+    # block (not handle) the stop signals so sigwait can sleep in the kernel.
+    # Done first so a signal during startup waits for the finally below;
+    # children inherit the mask and unblock it themselves.
+    signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+    workers_stop = None
+    helpers = []
+    try:
+        print("=== QueueCTL Runner ===")
+        print("Starting workers...")
 
-    # Start background processes
-    enqueue_proc = Process(target=auto_enqueue_loop)
-    status_proc = Process(target=status_loop)
+        # Start workers
+        workers_stop = start_workers(count=2, daemon=True)
 
-    enqueue_proc.start()
-    status_proc.start()
+        wait_for_workers()
 
-    print("[runner] System running. Press CTRL + C to stop.")
+        # Start background processes
+        for target in (auto_enqueue_loop, status_loop, housekeep_loop):
+            proc = Process(target=run_child, args=(target,))
+            proc.start()
+            helpers.append(proc)
 
-    try:
-        while not RUNNER_STOP:
-            time.sleep(0.5)
+        print("[runner] System running. Press CTRL + C to stop.")
+
+        sig = signal.sigwait(STOP_SIGNALS)
+        print(f"\n[runner] {signal.Signals(sig).name} received, stopping...")
     finally:
         print("[runner] Cleaning up...")
-        enqueue_proc.terminate()
-        status_proc.terminate()
-
-        # Remove flags and pidfile
-        if os.path.exists(PIDFILE):
-            os.remove(PIDFILE)
-        if os.path.exists(STOP_FLAG):
-            os.remove(STOP_FLAG)
+        # tell workers to finish their current job and exit
+        if workers_stop is not None:
+            workers_stop.set()
+        for proc in helpers:
+            proc.terminate()
+
+        # Remove pidfile
+        remove_if_exists(PIDFILE)
 
         print("[runner] Shutdown complete.")
 
@@ -1,26 +1,181 @@
 # storage.py
 # Responsible for DB access, schema, config and atomic job claiming.
 
+import os
 import sqlite3
+import threading
 import time
-import datetime
-from typing import Optional, Dict, Any, Tuple, List
+import weakref
+from collections import namedtuple
+from typing import Optional, Dict, Any, Tuple, List, Iterable, Iterator
 
 DB_PATH = "jobs.sqlite"
 
-def iso_now() -> str:
-    return datetime.datetime.utcnow().isoformat() + "Z"
+# per-connection settings, applied every time a connection is opened.
+# WAL needs shared memory between processes, so the DB file must live on
+# a local disk (not NFS/SMB). NORMAL sync is durable enough under WAL.
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA wal_autocheckpoint = 1000",
+)
+
+# what claim_next_job hands to a worker
+Claimed = namedtuple("Claimed", "id command attempts max_retries")
+
+# hot-path statements; sqlite3 reuses the compiled form per connection
+_SQL_INSERT_JOB = """
+INSERT INTO jobs(external_id, command, state, attempts, max_retries, created_at, updated_at, available_at)
+VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)
+"""
+_SQL_CLAIM_JOB = """
+UPDATE jobs SET state='processing', worker_pid=?, updated_at=?
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE state = 'pending' AND available_at <= ?
+    ORDER BY created_at ASC, id ASC
+    LIMIT 1
+)
+RETURNING id, command, attempts, max_retries
+"""
+_SQL_UPDATE_RESULT = """
+UPDATE jobs
+SET state = ?, attempts = ?, last_error = ?, updated_at = ?, available_at = ?, worker_pid = NULL
+WHERE id = ?
+"""
+# completed path only touches the columns that change -> smaller WAL frames
+_SQL_MARK_COMPLETED = "UPDATE jobs SET state = 'completed', updated_at = ?, worker_pid = NULL WHERE id = ?"
+# one housekeep() batch: oldest finished jobs first. Without the hint the planner
+# prefers (state, created_at) and sorts every finished row for each batch.
+_SQL_ARCHIVE_BATCH = """
+SELECT id FROM jobs INDEXED BY idx_jobs_finished_updated
+WHERE state IN ('completed', 'dead') AND updated_at < ?
+ORDER BY updated_at
+LIMIT ?
+"""
+_SQL_REGISTER_WORKER = "INSERT OR IGNORE INTO workers_meta(pid, started_at) VALUES(?, ?)"
+_SQL_UNREGISTER_WORKER = "DELETE FROM workers_meta WHERE pid = ?"
+
+def now_ms() -> int:
+    """Current unix time in milliseconds (stored in created_at/updated_at)."""
+    return int(time.time() * 1000)
+
+def ms_to_iso(ms: Optional[int]) -> Optional[str]:
+    """Render a unix-ms timestamp as an ISO-8601 UTC string for display."""
+    if ms is None:
+        return None
+    ms = int(ms)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ms // 1000)) + f".{ms % 1000:03d}Z"
+
+def job_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """Convert a jobs row to a dict with human-readable timestamps."""
+    d = dict(row)
+    for key in ("created_at", "updated_at"):
+        if key in d:
+            d[key] = ms_to_iso(d[key])
+    return d
+
+def job_tuples_to_dicts(keys: List[str], rows: Iterable[tuple]) -> Iterator[Dict[str, Any]]:
+    """Like job_to_dict, but for plain tuples from Storage.iter_jobs: one dict per row."""
+    ts_idx = [i for i, k in enumerate(keys) if k in ("created_at", "updated_at")]
+    for r in rows:
+        d = dict(zip(keys, r))
+        for i in ts_idx:
+            d[keys[i]] = ms_to_iso(r[i])
+        yield d
+
+# every live Storage, so a forked child can drop the handles it inherited
+_instances = weakref.WeakSet()
+# connections inherited across fork: kept referenced so they are never closed
+# (closing the parent's handle in the child can disturb the parent's locks/WAL)
+_inherited_conns = []
+
+def _after_fork_in_child():
+    for storage in list(_instances):
+        storage._reopen()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+# UPDATE ... RETURNING (used to claim jobs) needs SQLite 3.35+
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+def is_busy_error(exc: sqlite3.OperationalError) -> bool:
+    """True if exc means another connection holds the lock (worth retrying)."""
+    code = getattr(exc, "sqlite_errorcode", None)  # Python 3.11+
+    if code is not None:
+        return code & 0xff in (SQLITE_BUSY, SQLITE_LOCKED)
+    msg = str(exc)
+    return "locked" in msg or "busy" in msg
 
 class Storage:
     def __init__(self, db_path: str = DB_PATH):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(
+                f"QueueCTL needs SQLite >= {'.'.join(map(str, MIN_SQLITE_VERSION))}, "
+                f"but Python is linked against {sqlite3.sqlite_version}")
         self.db_path = db_path
-        # allow multithread/process access
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
-        self.conn.row_factory = sqlite3.Row
+        # one connection per thread and per process; never shared across fork
+        self._local = threading.local()
+        _instances.add(self)
         self.init_schema()
+        # config is read once per Storage; values set from another process
+        # are picked up by constructing a new Storage
+        self._config_lock = threading.Lock()
+        self._config_cache = dict(self.conn.execute("SELECT key, value FROM config").fetchall())
+
+    def _get_conn(self) -> sqlite3.Connection:
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, "pid", None) != pid:
+            # autocommit mode: multi-statement transactions use explicit BEGIN
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30,
+                                   isolation_level=None, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            local.conn = conn
+            # reused cursors; thread-local like the connection, so no locking
+            local.r_cur = conn.cursor()
+            local.w_cur = conn.cursor()
+            # claims return plain tuples; skips building a sqlite3.Row per job
+            local.claim_cur = conn.cursor()
+            local.claim_cur.row_factory = None
+            local.pid = pid
+        return local.conn
+
+    def _reopen(self):
+        """
+        Called in a freshly forked child: forget the parent's connection so
+        the next access opens a new one (with CONNECTION_PRAGMAS re-applied).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            _inherited_conns.append(conn)
+        self._local = threading.local()
+        self._config_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self._get_conn()
+
+    def _reader(self) -> sqlite3.Cursor:
+        self._get_conn()
+        return self._local.r_cur
+
+    def _writer(self) -> sqlite3.Cursor:
+        self._get_conn()
+        return self._local.w_cur
 
     def init_schema(self):
         cur = self.conn.cursor()
+        self._migrate_text_timestamps()
         cur.executescript("""
         PRAGMA journal_mode = WAL;
         CREATE TABLE IF NOT EXISTS jobs (
@@ -30,14 +185,20 @@ class Storage:
             state TEXT NOT NULL,
             attempts INTEGER NOT NULL DEFAULT 0,
             max_retries INTEGER NOT NULL DEFAULT 3,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
             available_at INTEGER NOT NULL DEFAULT 0,
             last_error TEXT,
             worker_pid INTEGER
         );
 
-        CREATE INDEX IF NOT EXISTS idx_jobs_state_available ON jobs(state, available_at);
+        -- partial indexes stay small no matter how many finished jobs pile up;
+        -- (state, created_at) serves list_jobs(state=...) and its ORDER BY
+        DROP INDEX IF EXISTS idx_jobs_state_available;
+        CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs(state, created_at);
+        CREATE INDEX IF NOT EXISTS idx_jobs_pending_ready ON jobs(available_at, created_at) WHERE state = 'pending';
+        CREATE INDEX IF NOT EXISTS idx_jobs_dead_created ON jobs(created_at) WHERE state = 'dead';
+        CREATE INDEX IF NOT EXISTS idx_jobs_finished_updated ON jobs(updated_at) WHERE state IN ('completed', 'dead');
         
         CREATE TABLE IF NOT EXISTS config (
             key TEXT PRIMARY KEY,
@@ -46,30 +207,161 @@ class Storage:
 
         CREATE TABLE IF NOT EXISTS workers_meta (
             pid INTEGER PRIMARY KEY,
-            started_at TEXT
+            started_at INTEGER
+        );
+
+        -- finished jobs moved out of the hot table by housekeep(); same columns as jobs
+        CREATE TABLE IF NOT EXISTS jobs_archive (
+            id INTEGER PRIMARY KEY,
+            external_id TEXT,
+            command TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_retries INTEGER NOT NULL DEFAULT 3,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            available_at INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            worker_pid INTEGER
         );
         """)
+        self._ensure_state_counters()
         # defaults
         cur.execute("INSERT OR IGNORE INTO config(key, value) VALUES(?,?)", ("backoff_base", "2"))
         cur.execute("INSERT OR IGNORE INTO config(key, value) VALUES(?,?)", ("default_max_retries", "3"))
-        self.conn.commit()
+
+    def _text_timestamp_tables(self) -> List[str]:
+        conn = self.conn
+        tables = []
+        for table, column in (("jobs", "created_at"), ("workers_meta", "started_at")):
+            cols = {r["name"]: r["type"] for r in conn.execute(f"PRAGMA table_info({table})")}
+            if cols.get(column, "INTEGER").upper() == "TEXT":
+                tables.append(table)
+        return tables
+
+    def _migrate_text_timestamps(self):
+        """
+        Older databases stored jobs.created_at/updated_at and
+        workers_meta.started_at as ISO TEXT. Rebuild those tables with INTEGER
+        unix-ms columns, converting existing values.
+        """
+        conn = self.conn
+        if not self._text_timestamp_tables():
+            return
+        # ISO text -> unix ms; julianday() accepts the trailing 'Z' and fractions
+        to_ms = "CAST(ROUND((julianday({0}) - 2440587.5) * 86400000) AS INTEGER)"
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # re-check under the write lock in case another process just migrated
+            tables = self._text_timestamp_tables()
+            if "jobs" in tables:
+                conn.execute("""
+                CREATE TABLE jobs_migrated (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    external_id TEXT UNIQUE,
+                    command TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_retries INTEGER NOT NULL DEFAULT 3,
+                    created_at INTEGER NOT NULL,
+                    updated_at INTEGER NOT NULL,
+                    available_at INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    worker_pid INTEGER
+                )""")
+                conn.execute(f"""
+                INSERT INTO jobs_migrated
+                SELECT id, external_id, command, state, attempts, max_retries,
+                       {to_ms.format("created_at")}, {to_ms.format("updated_at")},
+                       available_at, last_error, worker_pid
+                FROM jobs""")
+                conn.execute("DROP TABLE jobs")
+                conn.execute("ALTER TABLE jobs_migrated RENAME TO jobs")
+            if "workers_meta" in tables:
+                conn.execute("""
+                CREATE TABLE workers_meta_migrated (
+                    pid INTEGER PRIMARY KEY,
+                    started_at INTEGER
+                )""")
+                conn.execute(f"""
+                INSERT INTO workers_meta_migrated
+                SELECT pid, {to_ms.format("started_at")} FROM workers_meta""")
+                conn.execute("DROP TABLE workers_meta")
+                conn.execute("ALTER TABLE workers_meta_migrated RENAME TO workers_meta")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _ensure_state_counters(self):
+        """
+        Keep per-state job counts in state_counters, maintained by triggers in
+        the same transaction as every jobs insert/update/delete, so
+        state_counts() never scans jobs. Built (and backfilled) once; rebuilt
+        if the triggers went missing, e.g. after the jobs table was recreated.
+        """
+        conn = self.conn
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'jobs_state_del'").fetchone():
+            return
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # re-check under the write lock in case another process just did it
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'jobs_state_del'").fetchone():
+                conn.execute("""
+                CREATE TABLE IF NOT EXISTS state_counters (
+                    state TEXT PRIMARY KEY,
+                    n INTEGER NOT NULL DEFAULT 0
+                )""")
+                conn.execute("DELETE FROM state_counters")
+                conn.execute("INSERT INTO state_counters(state, n) SELECT state, COUNT(*) FROM jobs GROUP BY state")
+                conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS jobs_state_ins AFTER INSERT ON jobs BEGIN
+                    INSERT INTO state_counters(state, n) VALUES (NEW.state, 1)
+                    ON CONFLICT(state) DO UPDATE SET n = n + 1;
+                END""")
+                conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS jobs_state_upd AFTER UPDATE OF state ON jobs
+                WHEN OLD.state IS NOT NEW.state BEGIN
+                    UPDATE state_counters SET n = n - 1 WHERE state = OLD.state;
+                    INSERT INTO state_counters(state, n) VALUES (NEW.state, 1)
+                    ON CONFLICT(state) DO UPDATE SET n = n + 1;
+                END""")
+                # created last: its presence marks the whole setup as done
+                conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS jobs_state_del AFTER DELETE ON jobs BEGIN
+                    UPDATE state_counters SET n = n - 1 WHERE state = OLD.state;
+                END""")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
     # ------------- config helpers -------------
     def get_config(self, key: str, default: Optional[str] = None) -> Optional[str]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT value FROM config WHERE key = ?", (key,))
-        row = cur.fetchone()
-        return row["value"] if row else default
+        return self._config_cache.get(key, default)
 
     def set_config(self, key: str, value: str):
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value)
-        )
-        self.conn.commit()
+        with self._config_lock:
+            cur = self._writer()
+            cur.execute(
+                "INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (key, value)
+            )
+            self._config_cache[key] = value
 
     # ------------- job CRUD -------------
+    @staticmethod
+    def _job_row(job: Dict[str, Any], now: int, default_max_retries: str) -> Tuple:
+        cmd = job.get("command")
+        if not cmd:
+            raise ValueError("job must include 'command'")
+
+        external_id = job.get("id") or job.get("external_id")  # accept either
+        attempts = int(job.get("attempts", 0))
+        max_retries = int(job.get("max_retries", default_max_retries))
+        available_at = int(job.get("available_at", 0))
+        return (external_id, cmd, attempts, max_retries, now, now, available_at)
+
     def add_job(self, job: Dict[str, Any]) -> int:
         """
         job: dictionary possibly containing:
@@ -79,125 +371,237 @@ class Storage:
           - available_at: optional (unix ts)
         Returns the internal integer id.
         """
-        now = iso_now()
-        cmd = job.get("command")
-        if not cmd:
-            raise ValueError("job must include 'command'")
+        row = self._job_row(job, now_ms(), self._config_cache.get("default_max_retries", "3"))
 
-        external_id = job.get("id") or job.get("external_id")  # accept either
-        attempts = int(job.get("attempts", 0))
-        max_retries = int(job.get("max_retries", self.get_config("default_max_retries", "3")))
-        available_at = int(job.get("available_at", 0))
-
-        cur = self.conn.cursor()
+        cur = self._writer()
         try:
-            cur.execute("""
-            INSERT INTO jobs(external_id, command, state, attempts, max_retries, created_at, updated_at, available_at)
-            VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)
-            """, (external_id, cmd, attempts, max_retries, now, now, available_at))
-            self.conn.commit()
+            cur.execute(_SQL_INSERT_JOB, row)
             return cur.lastrowid
         except sqlite3.IntegrityError as e:
             # likely duplicate external_id
             raise
 
+    def add_jobs(self, jobs: List[Dict[str, Any]]) -> List[int]:
+        """
+        Insert many jobs (same format as add_job) in one transaction.
+        Returns the internal ids in input order. Nothing is inserted if any
+        job is invalid or collides on external_id.
+        """
+        if not jobs:
+            return []
+        now = now_ms()
+        default_max_retries = self._config_cache.get("default_max_retries", "3")
+        rows = [self._job_row(job, now, default_max_retries) for job in jobs]
+
+        cur = self._writer()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.executemany(_SQL_INSERT_JOB, rows)
+            # the write lock makes the new ids contiguous, ending at the last one
+            last_id = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
     def get_job(self, internal_id: int) -> Optional[sqlite3.Row]:
-        cur = self.conn.cursor()
+        cur = self._reader()
         cur.execute("SELECT * FROM jobs WHERE id = ?", (internal_id,))
         return cur.fetchone()
 
-    def list_jobs(self, state: Optional[str] = None, limit: int = 100) -> List[sqlite3.Row]:
-        cur = self.conn.cursor()
+    @staticmethod
+    def _list_jobs_query(state: Optional[str], limit: int) -> Tuple[str, tuple]:
         if state:
-            cur.execute("SELECT * FROM jobs WHERE state = ? ORDER BY created_at DESC LIMIT ?", (state, limit))
-        else:
-            cur.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+            return "SELECT * FROM jobs WHERE state = ? ORDER BY created_at DESC, id DESC LIMIT ?", (state, limit)
+        return "SELECT * FROM jobs ORDER BY created_at DESC, id DESC LIMIT ?", (limit,)
+
+    def list_jobs(self, state: Optional[str] = None, limit: int = 100) -> List[sqlite3.Row]:
+        cur = self._reader()
+        cur.execute(*self._list_jobs_query(state, limit))
         return cur.fetchall()
 
+    def iter_jobs(self, state: Optional[str] = None, limit: int = 100) -> Tuple[List[str], Iterator[tuple]]:
+        """
+        Streaming variant of list_jobs: returns (column names, iterator of
+        plain tuples), so large listings skip building a Row per job.
+        """
+        cur = self.conn.cursor()  # own cursor: stays open while the caller iterates
+        cur.row_factory = None
+        cur.execute(*self._list_jobs_query(state, limit))
+        return [d[0] for d in cur.description], cur
+
     # atomic claim
-    def claim_next_job(self, worker_pid: int) -> Optional[sqlite3.Row]:
+    def claim_next_job(self, worker_pid: int) -> Optional[Claimed]:
         """
         Atomically claim one pending job whose available_at <= now.
-        Returns the claimed job (row) or None.
+        Returns the claimed job (id, command, attempts, max_retries) or None.
         """
-        cur = self.conn.cursor()
+        self._get_conn()
+        cur = self._local.claim_cur
         now_ts = int(time.time())
         try:
-            cur.execute("BEGIN IMMEDIATE")
-            cur.execute("""
-            SELECT * FROM jobs
-            WHERE state = 'pending' AND available_at <= ?
-            ORDER BY created_at ASC
-            LIMIT 1
-            """, (now_ts,))
-            row = cur.fetchone()
-            if not row:
-                self.conn.commit()
+            # single statement: pick + mark the oldest ready job (SQLite >= 3.35).
+            # fetchall() steps the statement to completion so its implicit
+            # transaction commits straight away.
+            cur.execute(_SQL_CLAIM_JOB, (worker_pid, now_ms(), now_ts))
+            rows = cur.fetchall()
+            return Claimed._make(rows[0]) if rows else None
+        except sqlite3.OperationalError as e:
+            # another writer held the lock too long: treat as "no job this time"
+            if is_busy_error(e):
                 return None
-            job_id = row["id"]
-            cur.execute("UPDATE jobs SET state='processing', worker_pid=?, updated_at=? WHERE id=?",
-                        (worker_pid, iso_now(), job_id))
-            self.conn.commit()
-            cur.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
-            return cur.fetchone()
-        except sqlite3.OperationalError:
-            try:
-                self.conn.rollback()
-            except Exception:
-                pass
-            return None
+            raise
 
     def update_job_result(self, job_id: int, state: str, attempts: int,
                           last_error: Optional[str] = None, available_at: int = 0):
-        cur = self.conn.cursor()
-        cur.execute("""
-        UPDATE jobs
-        SET state = ?, attempts = ?, last_error = ?, updated_at = ?, available_at = ?, worker_pid = NULL
-        WHERE id = ?
-        """, (state, attempts, last_error, iso_now(), available_at, job_id))
-        self.conn.commit()
+        cur = self._writer()
+        cur.execute(_SQL_UPDATE_RESULT, (state, attempts, last_error, now_ms(), available_at, job_id))
+
+    def mark_completed(self, job_id: int, ts: Optional[int] = None):
+        """Mark a job completed; attempts/last_error/available_at are left as-is."""
+        cur = self._writer()
+        cur.execute(_SQL_MARK_COMPLETED, (ts if ts is not None else now_ms(), job_id))
+
+    @staticmethod
+    def _write_results(cur: sqlite3.Cursor, results: List[Tuple[int, str, int, Optional[str], int]]):
+        now = now_ms()
+        completed = []
+        rows = []
+        for job_id, state, attempts, last_error, available_at in results:
+            if state == "completed":
+                completed.append((now, job_id))
+            else:
+                rows.append((state, attempts, last_error, now, available_at, job_id))
+        if completed:
+            cur.executemany(_SQL_MARK_COMPLETED, completed)
+        if rows:
+            cur.executemany(_SQL_UPDATE_RESULT, rows)
+
+    def update_job_results_bulk(self, results: List[Tuple[int, str, int, Optional[str], int]]):
+        """
+        Apply many job results in a single transaction.
+        results: list of (job_id, state, attempts, last_error, available_at).
+        Completed jobs take the narrower mark_completed update.
+        """
+        if not results:
+            return
+        cur = self._writer()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            self._write_results(cur, results)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def finish_and_claim(self, worker_pid: int,
+                         results: List[Tuple[int, str, int, Optional[str], int]]) -> Optional[Claimed]:
+        """
+        Write a worker's finished results (as update_job_results_bulk) and
+        claim its next job in one transaction, so results are saved before
+        the next job runs at no extra commit. Unlike claim_next_job, errors
+        are raised: on sqlite3.OperationalError nothing was written.
+        """
+        if not results:
+            self._get_conn()
+            rows = self._local.claim_cur.execute(
+                _SQL_CLAIM_JOB, (worker_pid, now_ms(), int(time.time()))).fetchall()
+            return Claimed._make(rows[0]) if rows else None
+        cur = self._writer()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            self._write_results(cur, results)
+            rows = self._local.claim_cur.execute(
+                _SQL_CLAIM_JOB, (worker_pid, now_ms(), int(time.time()))).fetchall()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return Claimed._make(rows[0]) if rows else None
 
     def move_to_dead(self, job_id: int, last_error: Optional[str] = None):
         self.update_job_result(job_id, "dead", self.get_job_attempts(job_id), last_error, 0)
 
     def get_job_attempts(self, job_id: int) -> int:
-        cur = self.conn.cursor()
+        cur = self._reader()
         cur.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,))
         r = cur.fetchone()
         return r["attempts"] if r else 0
 
     # worker meta
     def register_worker(self, pid: int):
-        cur = self.conn.cursor()
-        cur.execute("INSERT OR IGNORE INTO workers_meta(pid, started_at) VALUES(?, ?)", (pid, iso_now()))
-        self.conn.commit()
+        cur = self._writer()
+        cur.execute(_SQL_REGISTER_WORKER, (pid, now_ms()))
 
     def unregister_worker(self, pid: int):
-        cur = self.conn.cursor()
-        cur.execute("DELETE FROM workers_meta WHERE pid = ?", (pid,))
-        self.conn.commit()
+        cur = self._writer()
+        cur.execute(_SQL_UNREGISTER_WORKER, (pid,))
+
+    def worker_pids(self) -> set:
+        cur = self._reader()
+        cur.execute("SELECT pid FROM workers_meta")
+        return {r["pid"] for r in cur.fetchall()}
 
     def count_workers(self) -> int:
-        cur = self.conn.cursor()
+        cur = self._reader()
         cur.execute("SELECT COUNT(*) as c FROM workers_meta")
         return cur.fetchone()["c"]
 
+    def data_version(self) -> int:
+        """
+        Changes whenever another connection commits to the DB; much cheaper
+        than re-running a query to find out whether anything happened.
+        """
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
     # status counts
     def state_counts(self):
-        cur = self.conn.cursor()
-        cur.execute("SELECT state, COUNT(*) as cnt FROM jobs GROUP BY state")
-        return {r["state"]: r["cnt"] for r in cur.fetchall()}
+        cur = self._reader()
+        cur.execute("SELECT state, n FROM state_counters WHERE n > 0 ORDER BY state")
+        return {r["state"]: r["n"] for r in cur.fetchall()}
+
+    # housekeeping
+    def housekeep(self, max_age_s: int = 86400, batch_size: int = 1000) -> int:
+        """
+        Move completed/dead jobs last updated more than max_age_s ago into
+        jobs_archive, then truncate the WAL. Returns the number archived.
+        Works in batches of batch_size rows, one short transaction each, so
+        workers are never locked out for long.
+        """
+        cutoff = now_ms() - max_age_s * 1000
+        cur = self._writer()
+        archived = 0
+        while True:
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                cur.execute(f"INSERT INTO jobs_archive SELECT * FROM jobs WHERE id IN ({_SQL_ARCHIVE_BATCH})",
+                            (cutoff, batch_size))
+                cur.execute(f"DELETE FROM jobs WHERE id IN ({_SQL_ARCHIVE_BATCH})", (cutoff, batch_size))
+                moved = cur.rowcount
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            archived += moved
+            if moved < batch_size:
+                break
+        # PASSIVE copies the WAL back without blocking anyone; the TRUNCATE
+        # that follows then only has a short tail left while it holds writers off
+        cur.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        cur.fetchall()
+        cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cur.fetchall()
+        return archived
 
     # DLQ helpers
     def list_dead(self, limit: int = 100):
         return self.list_jobs("dead", limit)
 
     def retry_dead_job(self, job_id: int):
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM jobs WHERE id = ? AND state = 'dead'", (job_id,))
-        r = cur.fetchone()
-        if not r:
+        cur = self._writer()
+        cur.execute("UPDATE jobs SET state='pending', attempts=0, updated_at=?, available_at=? "
+                    "WHERE id=? AND state='dead'",
+                    (now_ms(), 0, job_id))
+        if cur.rowcount == 0:
             raise KeyError("dead job not found")
-        cur.execute("UPDATE jobs SET state='pending', attempts=0, updated_at=?, available_at=? WHERE id=?",
-                    (iso_now(), 0, job_id))
-        self.conn.commit()
@@ -3,21 +3,63 @@
 
 import os
 import signal
+import sqlite3
+import threading
 import time
 import subprocess
-from multiprocessing import Process, current_process
+import shlex
+import shutil
+from functools import lru_cache
+from collections import deque
+import multiprocessing
 from typing import Optional
-from storage import Storage
-import math
+from storage import Storage, is_busy_error
 
-STOP_FLAG = "workers.stop"
 PIDFILE = "workers.pid"
 
-storage = Storage()
+# Workers are forked from a clean forkserver process that has storage/worker
+# pre-imported: no parent state (DB handles, threads) leaks into them, and
+# startup avoids the full re-import that "spawn" does.
+mp_ctx = multiprocessing.get_context("forkserver")
+mp_ctx.set_forkserver_preload(["storage", "worker"])
+
+BACKOFF_CAP = 3600  # seconds
+BACKOFF_STEPS = 64
+
+# anything that needs /bin/sh to interpret it
+SHELL_CHARS = frozenset(';|&><$`*?~(){}[]#!\n')
+
+@lru_cache(maxsize=256)
+def _resolve(program: str) -> Optional[str]:
+    return shutil.which(program)
+
+def _split_simple(command: str) -> Optional[list]:
+    """
+    Return argv for a command that can be exec'd directly, or None if it
+    needs a shell (metacharacters, VAR=x prefixes, builtins like `exit`).
+    """
+    if not SHELL_CHARS.isdisjoint(command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0] or _resolve(argv[0]) is None:
+        return None
+    return argv
+
+def remove_if_exists(path: str):
+    """Delete a flag/pid file; one unlink instead of a stat + unlink, and no race."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
 def run_command(command: str, timeout: Optional[int] = None) -> (int, str):
+    # skipping /bin/sh saves a fork+exec; subprocess uses posix_spawn here
+    argv = _split_simple(command)
     try:
-        proc = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        proc = subprocess.run(argv if argv else command, shell=argv is None, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                               timeout=timeout, text=True)
         return proc.returncode, proc.stdout
     except subprocess.TimeoutExpired as te:
@@ -25,63 +67,131 @@ def run_command(command: str, timeout: Optional[int] = None) -> (int, str):
     except Exception as ex:
         return -1, str(ex)
 
-def worker_loop(worker_index: int):
+def backoff_table(base: float, cap: int = BACKOFF_CAP, steps: int = BACKOFF_STEPS) -> tuple:
+    """Delays base ** attempts for attempts 0..steps-1, capped at `cap` seconds."""
+    delays = []
+    for attempts in range(steps):
+        try:
+            delay = int(base ** attempts)
+        except OverflowError:
+            delay = cap
+        delays.append(min(cap, delay))
+    return tuple(delays)
+
+def set_from_signal(stop_event):
+    """Return a signal handler that sets stop_event.
+
+    Event.set() takes a non-reentrant lock the interrupted frame may already
+    hold, so the set happens on a short-lived thread instead.
+    """
+    def handler(sig, frame):
+        threading.Thread(target=stop_event.set, daemon=True).start()
+    return handler
+
+def worker_loop(worker_index: int, stop_event):
     pid = os.getpid()
+    # `queuectl worker stop` sends SIGTERM and Ctrl+C sends SIGINT to the
+    # whole process group: either way finish the current job, then exit
+    stop_handler = set_from_signal(stop_event)
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+    # the runner starts workers with these blocked; handlers are set, so
+    # anything already pending is delivered to them now
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+    # opened in the child so every worker has its own connection
+    storage = Storage()
     storage.register_worker(pid)
     worker_name = f"{pid}-{worker_index}"
     click_echo = print
     click_echo(f"[worker {worker_name}] started")
     backoff_base = float(storage.get_config("backoff_base", "2") or 2)
+    backoff = backoff_table(backoff_base)
+
+    # finished results are written together with the next claim; they stay
+    # buffered (and are retried) only while the DB is locked
+    pending_results = deque()
+
+    def flush_results():
+        if not pending_results:
+            return
+        try:
+            storage.update_job_results_bulk(list(pending_results))
+            pending_results.clear()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            click_echo(f"[worker {worker_name}] could not save {len(pending_results)} results: {e}")
 
     try:
         while True:
-            # check stop flag between jobs
-            if os.path.exists(STOP_FLAG):
-                click_echo(f"[worker {worker_name}] stop flag detected, exiting after current job")
+            # check stop event between jobs
+            if stop_event.is_set():
+                click_echo(f"[worker {worker_name}] stop requested, exiting after current job")
                 break
 
-            job = storage.claim_next_job(pid)
+            try:
+                job = storage.finish_and_claim(pid, list(pending_results))
+                pending_results.clear()
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                click_echo(f"[worker {worker_name}] claim failed, retrying: {e}")
+                job = None
             if not job:
-                time.sleep(0.5)
+                # returns early as soon as a stop is requested
+                stop_event.wait(timeout=0.5)
                 continue
 
-            job_id = job["id"]
-            command = job["command"]
-            attempts = int(job["attempts"])
-            max_retries = int(job["max_retries"])
+            job_id = job.id
+            command = job.command
+            attempts = job.attempts
+            max_retries = job.max_retries
 
             click_echo(f"[worker {worker_name}] claimed job {job_id} attempts={attempts}/{max_retries} cmd={command}")
 
             rc, output = run_command(command, timeout=300)
             if rc == 0:
-                storage.update_job_result(job_id, "completed", attempts, None, 0)
+                pending_results.append((job_id, "completed", attempts, None, 0))
                 click_echo(f"[worker {worker_name}] job {job_id} completed")
             else:
                 attempts += 1
-                # compute backoff: base ** attempts (bounded)
-                delay = int(math.pow(backoff_base, attempts))
-                if delay > 3600:  # cap at 1 hour
-                    delay = 3600
+                # backoff: base ** attempts, capped at 1 hour
+                delay = backoff[min(attempts, BACKOFF_STEPS - 1)]
                 avail = int(time.time()) + delay
                 last_err = f"rc={rc} out={(output or '')[:400]}"
                 if attempts > max_retries:
-                    storage.move_to_dead(job_id, last_err)
+                    pending_results.append((job_id, "dead", attempts, last_err, 0))
                     click_echo(f"[worker {worker_name}] job {job_id} moved to DLQ (attempts={attempts})")
                 else:
-                    storage.update_job_result(job_id, "failed", attempts, last_err, avail)
+                    pending_results.append((job_id, "failed", attempts, last_err, avail))
                     click_echo(f"[worker {worker_name}] job {job_id} failed -> retry in {delay}s (attempt {attempts})")
             # loop continues
     except KeyboardInterrupt:
         click_echo(f"[worker {worker_name}] interrupted")
     finally:
-        storage.unregister_worker(pid)
-        click_echo(f"[worker {worker_name}] stopped")
+        try:
+            flush_results()
+        finally:
+            storage.unregister_worker(pid)
+            click_echo(f"[worker {worker_name}] stopped")
+
 
+def wait_until_started(procs, timeout: float = 30):
+    """Wait until every worker has registered itself (or already exited)."""
+    storage = Storage()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        waiting = {p.pid for p in procs if p.exitcode is None} - storage.worker_pids()
+        if not waiting:
+            return
+        time.sleep(0.05)
 
 def start_workers(count: int, daemon: bool = False):
+    """Start `count` worker processes and return the event that stops them."""
+    stop_event = mp_ctx.Event()
     procs = []
     for i in range(count):
-        p = Process(target=worker_loop, args=(i,))
+        p = mp_ctx.Process(target=worker_loop, args=(i, stop_event))
         p.daemon = False
         p.start()
         procs.append(p)
@@ -91,18 +201,22 @@ def start_workers(count: int, daemon: bool = False):
         for p in procs:
             f.write(str(p.pid) + "\n")
 
+    # forkserver children open stop_event's semaphore by name after they start;
+    # if this process exited first (--daemon), the name would already be gone
+    wait_until_started(procs)
+
     print(f"Started {len(procs)} workers (PIDs written to {PIDFILE})")
     if not daemon:
+        set_stop = set_from_signal(stop_event)
+
         def handle_sigint(sig, frame):
             print("SIGINT received: stop workers gracefully")
-            open(STOP_FLAG, "w").close()
+            set_stop(sig, frame)
         signal.signal(signal.SIGINT, handle_sigint)
         try:
             for p in procs:
                 p.join()
         finally:
-            if os.path.exists(PIDFILE):
-                os.remove(PIDFILE)
-            if os.path.exists(STOP_FLAG):
-                os.remove(STOP_FLAG)
+            remove_if_exists(PIDFILE)
             print("All workers exited")
+    return stop_event